@@ -1,12 +1,22 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
 import re
 import os
+import codecs
+import html
 import json
+import tempfile
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from datetime import datetime
-from urllib.parse import urlparse
-from rapidfuzz import fuzz
+from rapidfuzz import fuzz, process
+from rapidfuzz.utils import default_process
+from charset_normalizer import from_bytes
 
 st.set_page_config(layout="wide")
 
@@ -15,6 +25,11 @@ st.title("🎉 Dropship Product & Inventory Manager")
 # Constants
 PRODUCTS_PER_PAGE = 20
 SELECTION_FILE = "selected_handles.json"
+FUZZY_SEARCH_CUTOFF = 80
+SKU_NUMBER_PATTERN = r'(?P<sku_num>\d+)'
+CSV_ENCODINGS = ['utf-8-sig', 'ISO-8859-1', 'windows-1252']
+CATEGORICAL_COLUMNS = ['Handle', 'Vendor', 'Type', 'Option1 Name']
+IMAGE_URL_PATTERN = re.compile(r'https?://[^\s/$.?#][^\s]*', re.IGNORECASE)
 
 # Session state
 if 'selected_handles' not in st.session_state:
@@ -29,6 +44,12 @@ if 'last_output_df' not in st.session_state:
     st.session_state.last_output_df = None
 if 'merged_df_cache' not in st.session_state:
     st.session_state.merged_df_cache = None
+if 'upload_key' not in st.session_state:
+    st.session_state.upload_key = None
+    st.session_state.product_key = None
+    st.session_state.merged_key = None
+    st.session_state.inventory_skus = None
+    st.session_state.upload_warnings = []
 if 'full_product_df' not in st.session_state:
     st.session_state.full_product_df = None
 if 'product_page' not in st.session_state:
@@ -37,110 +58,327 @@ if 'selected_page' not in st.session_state:
     st.session_state.selected_page = 1
 if 'search_query' not in st.session_state:
     st.session_state.search_query = ""
+if 'persisted_handles' not in st.session_state:
+    st.session_state.persisted_handles = frozenset(st.session_state.selected_handles)
 
 # --- Helper Functions ---
+def hash_frame(df):
+    # Hash every row: Streamlit's default DataFrame hash samples frames over 50k rows,
+    # which can hand back a stale result for a re-uploaded file of the same shape
+    return tuple(map(str, df.columns)), pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes()
+
+FRAME_HASH_FUNCS = {pd.DataFrame: hash_frame}
+
 def save_selected_handles():
-    with open(SELECTION_FILE, "w") as f:
-        json.dump(list(st.session_state.selected_handles), f)
+    # Only write when the selection differs from what is on disk, and swap the
+    # file in atomically so a crash mid-write can't leave it truncated. Each
+    # write gets its own temp file, so concurrent sessions can't interleave
+    snapshot = frozenset(st.session_state.selected_handles)
+    if snapshot == st.session_state.persisted_handles:
+        return
+    with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(os.path.abspath(SELECTION_FILE)), suffix=".tmp", delete=False) as f:
+        tmp_path = f.name
+        try:
+            json.dump(list(snapshot), f)
+        except Exception:
+            f.close()
+            os.remove(tmp_path)
+            raise
+    os.replace(tmp_path, SELECTION_FILE)
+    st.session_state.persisted_handles = snapshot
 
-def read_csv_with_fallback(uploaded_file):
-    content = uploaded_file.read()
-    for enc in ['utf-8-sig', 'ISO-8859-1', 'windows-1252']:
+def detect_encoding(content):
+    if content.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if content.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    # Sniff whole lines from the head of the file, limited to the encodings we read.
+    # Plain UTF-8 (the common case) is confirmed by a cheap decode first.
+    sample = content[:65536]
+    sample = sample[:sample.rfind(b'\n') + 1] or sample
+    try:
+        sample.decode('utf-8')
+        return 'utf-8-sig'
+    except UnicodeDecodeError:
+        pass
+    match = from_bytes(sample, cp_isolation=['utf_8', 'cp1252', 'latin_1']).best()
+    if match is None or match.encoding == 'utf_8':
+        return 'utf-8-sig'
+    return match.encoding
+
+def read_arrow_csv(content, enc, column_types=None):
+    # Blank cells read as nulls in text columns too, as with pandas
+    return pa_csv.read_csv(
+        BytesIO(content),
+        read_options=pa_csv.ReadOptions(encoding=enc),
+        convert_options=pa_csv.ConvertOptions(column_types=column_types, strings_can_be_null=True),
+    )
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def parse_csv_bytes(content, name):
+    # Parse once with the detected encoding; the rest are a last-ditch fallback
+    detected = detect_encoding(content)
+    for enc in [detected] + [e for e in CSV_ENCODINGS if e != detected]:
+        # The multi-threaded Arrow reader handles most exports; the C parser
+        # covers the files it rejects (short rows, odd quoting)
         try:
-            return pd.read_csv(BytesIO(content), encoding=enc)
+            table = read_arrow_csv(content, enc)
+            # Arrow infers dates and times (shifting timestamp offsets to UTC), whose
+            # text must round-trip unchanged to the exports: re-read those as text
+            temporal = {f.name: pa.string() for f in table.schema if pa.types.is_temporal(f.type)}
+            if temporal:
+                table = read_arrow_csv(content, enc, temporal)
+            # All-blank columns come out as float NaN, as with pandas
+            table = table.cast(pa.schema([f.with_type(pa.float64()) if pa.types.is_null(f.type) else f for f in table.schema]))
+            return table.to_pandas()
+        except Exception:
+            pass
+        try:
+            return pd.read_csv(BytesIO(content), encoding=enc, low_memory=False)
         except Exception:
             continue
-    st.warning(f"⚠️ Could not read {uploaded_file.name} with common encodings.")
     return None
 
-def extract_sku_number(sku):
-    match = re.search(r'\d+', str(sku))
-    return match.group() if match else ''
+def read_csv_files(uploaded_files):
+    # Parsed frames are cached on the file bytes, so reruns skip the CSV parse.
+    # The parsers release the GIL, so several uploads are read concurrently.
+    with ThreadPoolExecutor(max_workers=min(8, len(uploaded_files))) as pool:
+        return list(pool.map(lambda f: parse_csv_bytes(f.getvalue(), f.name), uploaded_files))
+
+def read_csv_with_fallback(uploaded_file):
+    return read_csv_files([uploaded_file])[0]
+
+@st.cache_data(show_spinner=False, max_entries=8, hash_funcs=FRAME_HASH_FUNCS)
+def to_csv_bytes(df):
+    # Written by pandas straight into one byte buffer in row chunks. Arrow's CSV
+    # writer is faster but changes the bytes Shopify re-imports: it quotes every
+    # string and writes true/false and 100 for True/False and 100.0
+    buf = BytesIO()
+    df.to_csv(buf, index=False, encoding="utf-8", chunksize=100_000)
+    return buf.getvalue()
+
+@st.cache_data(show_spinner=False, max_entries=8, hash_funcs=FRAME_HASH_FUNCS)
+def to_parquet_bytes(df):
+    buf = BytesIO()
+    try:
+        df.to_parquet(buf, index=False, compression='zstd')
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        # Mixed-type object columns (a barcode read as a number from one upload and
+        # as text from another) are written as text
+        buf = BytesIO()
+        mixed = df.select_dtypes('object').columns
+        df.astype({col: 'string' for col in mixed}).to_parquet(buf, index=False, compression='zstd')
+    return buf.getvalue()
+
+def to_categoricals(df):
+    # Low-cardinality keys hash and compare as integer codes in groupby/isin
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    return df
+
+def downcast_integers(df):
+    # Stock counts, grams and positions fit in narrower ints; values are unchanged
+    for col in df.select_dtypes('integer').columns:
+        df[col] = pd.to_numeric(df[col], downcast='integer')
+    return df
+
+def extract_sku_numbers(skus):
+    # One RE2 pass over the Arrow string buffer instead of a per-cell Python regex
+    arr = pa.array(skus.astype(str), type=pa.string(), from_pandas=True)
+    nums = pc.struct_field(pc.extract_regex(arr, SKU_NUMBER_PATTERN), [0])
+    return nums.to_pandas().set_axis(skus.index).fillna('')
+
+def sku_column(df):
+    return 'Variant SKU' if 'Variant SKU' in df.columns else 'SKU' if 'SKU' in df.columns else None
 
 def preprocess_sku(df):
     if df is None:
         return pd.DataFrame()  # Safely return empty DataFrame if file couldn't be read
-    df = df.copy()
-    sku_col = 'Variant SKU' if 'Variant SKU' in df.columns else 'SKU' if 'SKU' in df.columns else None
+    sku_col = sku_column(df)
     if not sku_col:
-        st.warning("⚠️ SKU column not found. Expected 'Variant SKU' or 'SKU'.")
-        return pd.DataFrame()
-    df['sku_num'] = df[sku_col].apply(extract_sku_number)
-    return df[df['sku_num'].notna() & (df['sku_num'] != '')]
+        return pd.DataFrame()  # Reported once per upload by the upload block
+    # assign adds the key column without copying the rest of the frame
+    sku_nums = extract_sku_numbers(df[sku_col])
+    return df.assign(sku_num=sku_nums)[sku_nums != '']
+
+def product_titles(df):
+    # Normalized once per title so the scorer can skip its own preprocessing
+    if 'Title' not in df.columns:
+        return np.full(len(df), '', dtype=object)
+    return np.array([default_process(t) for t in df['Title'].fillna('').astype(str)], dtype=object)
 
+@st.cache_data(show_spinner=False, max_entries=8, hash_funcs=FRAME_HASH_FUNCS)
 def fuzzy_match_inventory(product_df, inventory_df):
     product_df = preprocess_sku(product_df)
     inventory_df = preprocess_sku(inventory_df)
 
     qty_cols = [c for c in inventory_df.columns if 'Available' in c or 'On hand' in c]
     if qty_cols:
-        inventory_df['total_available'] = inventory_df[qty_cols].fillna(0).sum(axis=1)
+        inventory_df = inventory_df.assign(total_available=inventory_df[qty_cols].fillna(0).sum(axis=1))
         inventory_df = inventory_df[inventory_df['total_available'] > 0]
 
-    merged_rows = []
-    for _, prod_row in product_df.iterrows():
-        sku = prod_row['sku_num']
-        match = inventory_df[inventory_df['sku_num'] == sku]
-        if not match.empty:
-            best_match = match.iloc[0]
-            merged_row = pd.concat([prod_row, best_match.drop(labels=product_df.columns.intersection(inventory_df.columns))])
-        else:
-            merged_row = prod_row
-        merged_rows.append(merged_row)
+    # Only keys, titles and quantities are carried into the merge; the inventory
+    # export uses the full SKU-keyed frame kept in session state
+    inv_keep = ['Variant SKU', 'SKU', 'Title', 'sku_num', 'total_available'] + qty_cols
+    inventory_df = inventory_df[[c for c in inventory_df.columns if c in inv_keep]]
 
-    return pd.DataFrame(merged_rows)
+    if product_df.empty or inventory_df.empty:
+        return product_df
 
-def display_product_tiles(merged_df, page_key="product", search_query=""):
+    # Hash-join rows on SKU number to find the candidates
+    sku_unique = inventory_df['sku_num'].is_unique
+    pairs = pd.DataFrame({'sku_num': product_df['sku_num'].to_numpy(), 'prod_pos': np.arange(len(product_df))}).merge(
+        pd.DataFrame({'sku_num': inventory_df['sku_num'].to_numpy(), 'inv_pos': np.arange(len(inventory_df))}),
+        on='sku_num',
+        validate='m:1' if sku_unique else None,
+    )
+    if sku_unique:
+        best = pairs
+    else:
+        # Repeated inventory SKUs are resolved by the best title per product
+        prod_titles = product_titles(product_df)
+        inv_titles = product_titles(inventory_df)
+        pairs = pairs.sort_values(['prod_pos', 'inv_pos'], ignore_index=True)
+        pairs['score'] = process.cpdist(
+            prod_titles[pairs['prod_pos']], inv_titles[pairs['inv_pos']],
+            scorer=fuzz.token_set_ratio, processor=None, dtype=np.int16, workers=-1,
+        )
+        best = pairs.loc[pairs.groupby('prod_pos')['score'].idxmax()]
+    best_idx = np.zeros(len(product_df), dtype=np.intp)
+    has_match = np.zeros(len(product_df), dtype=bool)
+    best_idx[best['prod_pos']] = best['inv_pos']
+    has_match[best['prod_pos']] = True
+
+    # SKU numbers that differ only by leading zeros ("0100" vs "100") get a second join
+    unmatched = np.flatnonzero(~has_match)
+    if unmatched.size:
+        inv_by_key = pd.Series(np.arange(len(inventory_df)), index=inventory_df['sku_num'].str.lstrip('0').to_numpy())
+        inv_by_key = inv_by_key[~inv_by_key.index.duplicated()]
+        found = product_df['sku_num'].iloc[unmatched].str.lstrip('0').map(inv_by_key).to_numpy()
+        hit = ~np.isnan(found)
+        best_idx[unmatched[hit]] = found[hit].astype(np.intp)
+        has_match[unmatched[hit]] = True
+
+    inv_cols = inventory_df.columns.difference(product_df.columns, sort=False)
+    matched = inventory_df[inv_cols].iloc[best_idx].reset_index(drop=True)
+    matched = matched.where(np.broadcast_to(has_match[:, None], matched.shape))
+    return pd.concat([product_df.reset_index(drop=True), matched], axis=1)
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def group_by_handle(_merged_df, frame_key):
+    # Row positions per handle, in handle order. The frame itself is not hashed:
+    # frame_key names the uploads it was built from. These lookups are shared
+    # as-is (never copied) and must be treated as read-only by callers
+    return _merged_df.groupby("Handle", observed=True).indices
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def build_search_index(_merged_df, frame_key):
+    # One lowercase text blob per handle (titles, handle and SKUs), built once per frame
+    text_cols = [_merged_df[c].astype('string').fillna('') for c in ('Title', 'Handle', 'Variant SKU') if c in _merged_df.columns]
+    row_text = text_cols[0].str.cat(text_cols[1:], sep=' ')
+    return row_text.groupby(_merged_df['Handle'], observed=True).agg(' '.join).str.lower()
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def build_tiles(_merged_df, frame_key):
+    # Tile headers (first title, stock summed across variants), aggregated once per frame
+    grouped = _merged_df.groupby("Handle", observed=True)
+    handles = grouped.size().index
+    qty_col = next((c for c in _merged_df.columns if 'Available' in c or 'On hand' in c), None)
+    titles = grouped['Title'].first().astype(object) if 'Title' in _merged_df.columns else pd.Series(None, index=handles, dtype=object)
+    tiles = pd.DataFrame({
+        'title': titles.fillna(pd.Series(handles.astype(object), index=handles)),
+        'available': grouped[qty_col].sum().astype('int64') if qty_col else 'N/A',
+    }, index=handles)
+    return tiles
+
+def image_gallery_html(urls, width=100):
+    # Native lazy loading: the browser only fetches thumbnails as they scroll into view
+    return "".join(
+        f'<img src="{html.escape(url)}" width="{width}" loading="lazy" style="margin: 2px">'
+        for url in urls if IMAGE_URL_PATTERN.fullmatch(url)
+    )
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def search_handles(_merged_df, frame_key, query):
+    # Substring hits first; only when nothing matches (typos) fall back to a
+    # fuzzy scan of the per-handle blobs, best scores first
+    search_index = build_search_index(_merged_df, frame_key)
+    hits = search_index.index[search_index.str.contains(query, regex=False)].tolist()
+    if hits:
+        return hits
+    matches = process.extract(query, search_index, scorer=fuzz.partial_ratio, score_cutoff=FUZZY_SEARCH_CUTOFF, limit=None)
+    return [handle for _, _, handle in matches]
+
+@lru_cache(maxsize=256)
+def normalize_query(query):
+    return query.strip().lower()
+
+def change_page(page_key, step):
+    st.session_state[f"{page_key}_page"] += step
+
+def toggle_handle(handle, key):
+    # Runs once per click, before the rerun; tiles read the selection, never the widgets
+    if st.session_state[key]:
+        st.session_state.selected_handles.add(handle)
+    else:
+        st.session_state.selected_handles.discard(handle)
+    save_selected_handles()
+    st.session_state.selection_changed = True
+
+# Runs as a fragment so paging and tile widgets rerun only this grid, not the
+# whole upload/merge pipeline
+@st.fragment
+def display_product_tiles(merged_df, frame_key, page_key="product", search_query="", handles=None):
     current_page = st.session_state.get(f"{page_key}_page", 1)
-    grouped = merged_df.groupby("Handle")
-    filtered_grouped = []
-
-    if search_query:
-        for handle, group in grouped:
-            row_text = " ".join(group.astype(str).fillna("").values.flatten())
-            if fuzz.partial_ratio(search_query.lower(), row_text.lower()) > 50:
-                filtered_grouped.append((handle, group))
+    groups = group_by_handle(merged_df, frame_key)
+
+    if handles is not None:
+        filtered_handles = handles
+    elif search_query:
+        filtered_handles = search_handles(merged_df, frame_key, normalize_query(search_query))
     else:
-        filtered_grouped = list(grouped)
+        filtered_handles = list(groups)
 
-    total = len(filtered_grouped)
+    total = len(filtered_handles)
     start = (current_page - 1) * PRODUCTS_PER_PAGE
     end = start + PRODUCTS_PER_PAGE
-    paginated_grouped = filtered_grouped[start:end]
+    paginated_handles = filtered_handles[start:end]
+
+    page_tiles = build_tiles(merged_df, frame_key).loc[paginated_handles]
 
-    for handle, group in paginated_grouped:
+    for handle, name, available in page_tiles.itertuples(name=None):
         with st.container():
             cols = st.columns([0.1, 1.9])
             with cols[0]:
-                checked = handle in st.session_state.selected_handles
-                if st.checkbox("", value=checked, key=f"{page_key}_cb_{handle}"):
-                    st.session_state.selected_handles.add(handle)
-                else:
-                    st.session_state.selected_handles.discard(handle)
+                key = f"{page_key}_cb_{handle}"
+                st.session_state[key] = handle in st.session_state.selected_handles
+                st.checkbox("", key=key, on_change=toggle_handle, args=(handle, key))
             with cols[1]:
-                name = group['Title'].iloc[0] if 'Title' in group.columns else handle
-                available_col = [c for c in group.columns if 'Available' in c or 'On hand' in c]
-                available = group[available_col[0]].iloc[0] if available_col else 'N/A'
                 st.markdown(f"**{name}** - Available: {available}")
-                with st.expander("Details"):
-                    images = group['Image Src'].dropna().unique().tolist() if 'Image Src' in group.columns else []
+                # Images and the variant table are only built for tiles the user opens
+                if st.toggle("Details", key=f"{page_key}_details_{handle}"):
+                    group = merged_df.iloc[groups[handle]]
+                    images = group['Image Src'].dropna().astype(str).unique().tolist() if 'Image Src' in group.columns else []
                     if images:
-                        st.image(images, width=100)
+                        st.markdown(image_gallery_html(images), unsafe_allow_html=True)
                     st.dataframe(group, use_container_width=True)
 
     total_pages = max(1, (total + PRODUCTS_PER_PAGE - 1) // PRODUCTS_PER_PAGE)
     col1, col2, col3 = st.columns([1, 1, 2])
     with col1:
         if current_page > 1:
-            if st.button("⬅️ Previous", key=f"{page_key}_prev"):
-                st.session_state[f"{page_key}_page"] -= 1
+            st.button("⬅️ Previous", key=f"{page_key}_prev", on_click=change_page, args=(page_key, -1))
     with col2:
         if current_page < total_pages:
-            if st.button("Next ➡️", key=f"{page_key}_next"):
-                st.session_state[f"{page_key}_page"] += 1
+            st.button("Next ➡️", key=f"{page_key}_next", on_click=change_page, args=(page_key, 1))
     with col3:
         st.markdown(f"**Page {current_page} of {total_pages}**")
 
+    # The selected-products section lives outside this fragment, so refresh the app
+    if st.session_state.pop('selection_changed', False):
+        st.rerun()
+
 # Sidebar: Upload files and search
 st.sidebar.header("Upload Files")
 product_files = st.sidebar.file_uploader("Upload Product File(s)", type="csv", accept_multiple_files=True)
@@ -154,19 +392,49 @@ if st.sidebar.button("Clear Selection"):
     st.session_state.selected_handles.clear()
     save_selected_handles()
 
-# Preprocess uploaded files and cache merged result
-if product_files:
-    dfs = [read_csv_with_fallback(f) for f in product_files]
-    st.session_state.full_product_df = pd.concat(dfs, ignore_index=True)
-if product_files and inventory_file:
-    inventory_df = read_csv_with_fallback(inventory_file)
-    merged_df = fuzzy_match_inventory(st.session_state.full_product_df, inventory_df)
-    st.session_state.merged_df_cache = merged_df
+# Preprocess uploaded files and cache merged result. Parsing and matching only
+# rerun when the uploads change; other reruns reuse the frames in session state
+upload_key = (tuple(f.file_id for f in product_files), inventory_file.file_id if inventory_file else None)
+if upload_key != st.session_state.upload_key:
+    st.session_state.upload_key = upload_key
+    # Parse and SKU problems are kept with the upload so every rerun shows them, once each
+    upload_warnings = []
+    uploaded_dfs = []
+    if product_files:
+        parsed = read_csv_files(product_files)
+        upload_warnings += [f"⚠️ Could not read {f.name} with common encodings." for f, df in zip(product_files, parsed) if df is None]
+        dfs = [df for df in parsed if df is not None]
+        if len(dfs) > 1:
+            st.session_state.full_product_df = downcast_integers(to_categoricals(pd.concat(dfs, ignore_index=True)))
+        else:
+            st.session_state.full_product_df = downcast_integers(to_categoricals(dfs[0])) if dfs else None
+        if dfs:
+            uploaded_dfs.append(st.session_state.full_product_df)
+        st.session_state.product_key = upload_key[0]
+    if inventory_file:
+        inventory_df = read_csv_with_fallback(inventory_file)
+        if inventory_df is not None:
+            inventory_df = downcast_integers(inventory_df)
+            uploaded_dfs.append(inventory_df)
+        else:
+            upload_warnings.append(f"⚠️ Could not read {inventory_file.name} with common encodings.")
+        # Keyed once per upload for the inventory export
+        st.session_state.inventory_skus = preprocess_sku(inventory_df)
+    if product_files and inventory_file:
+        merged_df = fuzzy_match_inventory(st.session_state.full_product_df, inventory_df)
+        st.session_state.merged_df_cache = merged_df
+        st.session_state.merged_key = upload_key
+    if any(sku_column(df) is None for df in uploaded_dfs):
+        upload_warnings.append("⚠️ SKU column not found. Expected 'Variant SKU' or 'SKU'.")
+    st.session_state.upload_warnings = upload_warnings
+
+for message in st.session_state.upload_warnings:
+    st.warning(message)
 
 if st.session_state.merged_df_cache is not None:
     merged = st.session_state.merged_df_cache
     if not merged.empty:
-        display_product_tiles(merged, page_key="product", search_query=st.session_state.search_query)
+        display_product_tiles(merged, st.session_state.merged_key, page_key="product", search_query=st.session_state.search_query)
     else:
         st.info("🔍 No matching products with inventory available.")
 else:
@@ -174,21 +442,28 @@ else:
 
 # --- Selected Products Preview Section ---
 if st.session_state.full_product_df is not None:
-    selected_preview = st.session_state.full_product_df[st.session_state.full_product_df['Handle'].isin(st.session_state.selected_handles)]
-    if not selected_preview.empty:
+    # Selected rows come from the cached handle index, so only the selection is touched
+    full_product_df = st.session_state.full_product_df
+    handle_rows = group_by_handle(full_product_df, st.session_state.product_key)
+    selected = sorted(h for h in st.session_state.selected_handles if h in handle_rows)
+    if selected:
+        selected_preview = full_product_df.iloc[np.concatenate([handle_rows[h] for h in selected])]
         st.markdown("## ✅ Selected Products")
-        display_product_tiles(selected_preview, page_key="selected")
+        display_product_tiles(full_product_df, st.session_state.product_key, page_key="selected", handles=selected)
 
         # Output product file
-        output_product_df = st.session_state.full_product_df[st.session_state.full_product_df['Handle'].isin(st.session_state.selected_handles)]
-        output_product_df = output_product_df.drop_duplicates().sort_values(by="Handle")
-        csv_product = output_product_df.to_csv(index=False).encode("utf-8")
-        st.download_button("📦 Download Selected Product CSV", data=csv_product, file_name="selected_products.csv", mime="text/csv")
+        # Full-row dedup: image-only rows share a handle and a blank SKU. The sort
+        # must be stable so each product's first row (its product fields) stays first
+        output_product_df = selected_preview.drop_duplicates().sort_values(by="Handle", kind="stable", ignore_index=True)
+        # Downloads are only serialized when their button is clicked
+        st.download_button("📦 Download Selected Product CSV", data=lambda: to_csv_bytes(output_product_df), file_name="selected_products.csv", mime="text/csv")
+        st.download_button("🗜️ Download Selected Product Parquet", data=lambda: to_parquet_bytes(output_product_df), file_name="selected_products.parquet", mime="application/vnd.apache.parquet")
 
         # Output inventory file
-        if inventory_file:
-            inventory_df = preprocess_sku(read_csv_with_fallback(inventory_file))
-            selected_skus = selected_preview['Variant SKU'].dropna().apply(extract_sku_number).unique()
-            matched_inventory = inventory_df[inventory_df['sku_num'].isin(selected_skus)]
-            csv_inventory = matched_inventory.to_csv(index=False).encode("utf-8")
-            st.download_button("📦 Download Matching Inventory CSV", data=csv_inventory, file_name="matching_inventory.csv", mime="text/csv")
+        if inventory_file and st.session_state.inventory_skus is not None and not st.session_state.inventory_skus.empty:
+            inventory_df = st.session_state.inventory_skus
+            # Same key as the matcher's second join, so rows it matched on "0100" vs "100" are exported too
+            selected_skus = extract_sku_numbers(selected_preview['Variant SKU'].dropna())
+            selected_keys = selected_skus[selected_skus != ''].str.lstrip('0').unique()
+            matched_inventory = inventory_df[inventory_df['sku_num'].str.lstrip('0').isin(selected_keys)]
+            st.download_button("📦 Download Matching Inventory CSV", data=lambda: to_csv_bytes(matched_inventory), file_name="matching_inventory.csv", mime="text/csv")